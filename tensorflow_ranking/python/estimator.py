@@ -196,6 +196,8 @@ class EstimatorBuilder(object):
     self._scoring_function = scoring_function
     self._transform_function = transform_function
     self._hparams = hparams
+    self._cached_eval_metric_fns = None
+    self._concrete_transform_fns = {}
     self._validate_function_args_and_hparams()
 
     if not optimizer and not hparams.get("learning_rate"):
@@ -247,22 +249,102 @@ class EstimatorBuilder(object):
           mode=mode,
           scope="transform_layer")
 
+  def _transform_features_spec(self, mode):
+    """Returns a dict of `tf.TensorSpec` describing `_transform_fn` inputs.
+
+    The specs are derived from the parsing spec of the feature columns, the
+    same way `feature.encode_listwise_features` resolves feature names. Only
+    columns whose features parse to dense tensors (e.g., numeric columns) can
+    be described this way; columns that parse to `SparseTensor`s (e.g.,
+    categorical or embedding columns) are rejected.
+
+    Args:
+      mode: (`estimator.ModeKeys`) Specifies if this is for training,
+        evaluation or inference. See ModeKeys.
+
+    Returns:
+      A dict mapping feature names to `tf.TensorSpec`s. Context features get
+      2-D specs; example features get 2-D specs for the PREDICT mode
+      (pointwise) and 3-D specs otherwise (listwise).
+
+    Raises:
+      ValueError: If any feature column does not parse to a dense tensor.
+    """
+
+    def _dense_specs(feature_columns, batch_dims):
+      """Returns `tf.TensorSpec`s for the columns' dense parsing specs."""
+      specs = {}
+      parsing_spec = tf.feature_column.make_parse_example_spec(
+          feature_columns.values())
+      for name, spec in parsing_spec.items():
+        if not isinstance(spec, tf.io.FixedLenFeature):
+          raise ValueError(
+              "Only feature columns that parse to dense tensors are "
+              "supported, but the column for feature '{}' parses to "
+              "{}.".format(name, spec))
+        specs[name] = tf.TensorSpec(
+            batch_dims + list(spec.shape), spec.dtype, name=name)
+      return specs
+
+    specs = {}
+    if self._context_feature_columns:
+      specs.update(_dense_specs(self._context_feature_columns, [None]))
+    example_batch_dims = (
+        [None] if mode == tf.estimator.ModeKeys.PREDICT else [None, None])
+    specs.update(
+        _dense_specs(self._example_feature_columns, example_batch_dims))
+    return specs
+
+  def get_concrete_transform_fn(self, mode):
+    """Returns a concrete function for `_transform_fn` in the given `mode`.
+
+    The transform fn is traced at most once per mode, against an input
+    signature derived from the feature columns, so repeated calls with fresh
+    tensors of compatible shapes reuse the cached trace instead of retracing.
+    This is limited to feature columns that parse to dense tensors; see
+    `_transform_features_spec`. Calling the returned concrete function with a
+    feature dict relies on the structured calling convention of TF 2.3+.
+
+    Args:
+      mode: (`estimator.ModeKeys`) Specifies if this is for training,
+        evaluation or inference. See ModeKeys.
+
+    Returns:
+      A `ConcreteFunction` that takes a dict of feature tensors and returns
+      the `(context_features, example_features)` tuple of `_transform_fn`.
+
+    Raises:
+      ValueError: If any feature column does not parse to a dense tensor.
+    """
+    if mode not in self._concrete_transform_fns:
+      self._concrete_transform_fns[mode] = tf.function(
+          lambda features: self._transform_fn(features, mode)
+      ).get_concrete_function(self._transform_features_spec(mode))
+    return self._concrete_transform_fns[mode]
+
   def _eval_metric_fns(self):
-    """Returns a dict from name to metric functions."""
-    metric_fns = {}
-    metric_fns.update({
-        "metric/ndcg_%d" % topn: metrics.make_ranking_metric_fn(
-            metrics.RankingMetricKey.NDCG, topn=topn) for topn in [5, 10]
-    })
-    metric_fns.update({
-        "metric/mrr_%d" % topn: metrics.make_ranking_metric_fn(
-            metrics.RankingMetricKey.MRR, topn=topn) for topn in [10]
-    })
-    metric_fns.update({
-        "metric/%s" % name: metrics.make_ranking_metric_fn(name) for name in
-        [metrics.RankingMetricKey.MRR, metrics.RankingMetricKey.NDCG]
-    })
-    return metric_fns
+    """Returns a dict from name to metric functions.
+
+    The dict is built on the first call and cached on the builder, so that
+    repeated calls (e.g., when rebuilding the model fn) reuse the same
+    metric functions.
+    """
+    if self._cached_eval_metric_fns is None:
+      metric_fns = {}
+      metric_fns.update({
+          "metric/ndcg_%d" % topn: metrics.make_ranking_metric_fn(
+              metrics.RankingMetricKey.NDCG, topn=topn) for topn in [5, 10]
+      })
+      metric_fns.update({
+          "metric/mrr_%d" % topn: metrics.make_ranking_metric_fn(
+              metrics.RankingMetricKey.MRR, topn=topn) for topn in [10]
+      })
+      metric_fns.update({
+          "metric/%s" % name: metrics.make_ranking_metric_fn(name) for name in
+          [metrics.RankingMetricKey.MRR, metrics.RankingMetricKey.NDCG]
+      })
+      self._cached_eval_metric_fns = metric_fns
+    return self._cached_eval_metric_fns
 
   def _group_score_fn(self, context_features, group_features, mode, params,
                       config):
@@ -14,78 +14,191 @@
 
 """Tests for estimator.py."""
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
+import collections
+import functools
+import inspect
+import types
 
-import six
+from absl.testing import parameterized
+import numpy as np
 import tensorflow as tf
 
 from tensorflow_ranking.python import estimator as tfr_estimator
 from tensorflow_ranking.python import feature as feature_lib
 
 
+# The feature columns are stateless, so they are built once per process and
+# shared by all of the tests below. The read-only view keeps accidental
+# mutations from poisoning the cached dicts.
+@functools.lru_cache(maxsize=1)
 def _example_feature_columns():
-  return {
+  return types.MappingProxyType({
       name:
       tf.feature_column.numeric_column(name, shape=(1,), default_value=0.0)
       for name in ["f1", "f2", "f3"]
-  }
+  })
 
 
+@functools.lru_cache(maxsize=1)
 def _context_feature_columns():
-  return {
+  return types.MappingProxyType({
       name:
       tf.feature_column.numeric_column(name, shape=(1,), default_value=0.0)
       for name in ["c1"]
-  }
+  })
+
+
+# Bind the column dicts once, so the encoding path below sees the very same
+# objects on every call instead of re-resolving them through the helpers.
+_CONTEXT_FEATURE_COLUMNS = _context_feature_columns()
+_EXAMPLE_FEATURE_COLUMNS = _example_feature_columns()
 
 
 def _scoring_function(context_features, example_features, mode):
   del context_features
   del mode
-  batch_size = tf.shape(input=example_features["f1"])[0]
-  return tf.ones([batch_size, 1], dtype=tf.float32)
+  # Slicing keeps the static shape info, so no shape tensor is materialized.
+  return tf.ones_like(example_features["f1"][:, 0:1])
+
+
+# XLA fuses the slice and the ones allocation into one compiled kernel, and
+# the trace is cached across calls with the same input signature. The original
+# signature is pinned on the wrapper because `EstimatorBuilder` validates the
+# scoring fn with `inspect.getfullargspec`, which does not unwrap tf.function.
+_scoring_function = tf.function(
+    _scoring_function,
+    experimental_compile=True,
+    experimental_relax_shapes=True)
+_scoring_function.__signature__ = inspect.signature(
+    _scoring_function.python_function)
 
 
 def _multiply_by_two_transform_fn(features, mode):
-  for feature, tensor in six.iteritems(features):
-    features[feature] = 2 * tensor
+  # Stack features that share a shape and dtype, so that each group is
+  # doubled with a single multiply instead of one op per feature.
+  groups = collections.defaultdict(list)
+  for name, tensor in features.items():
+    groups[(tuple(tensor.shape.as_list()), tensor.dtype)].append(name)
+
+  doubled = {}
+  for names in groups.values():
+    stacked = tf.math.scalar_mul(
+        2.0, tf.stack([features[name] for name in names]))
+    doubled.update(zip(names, tf.unstack(stacked, num=len(names))))
 
   context, example = feature_lib.encode_listwise_features(
-      features=features,
-      context_feature_columns=_context_feature_columns(),
-      example_feature_columns=_example_feature_columns(),
+      features=doubled,
+      context_feature_columns=_CONTEXT_FEATURE_COLUMNS,
+      example_feature_columns=_EXAMPLE_FEATURE_COLUMNS,
       mode=mode)
   return context, example
 
 
+# The default hparams template. Tests that do not mutate the hparams can pass
+# this dict directly; tests that do should copy it via `_get_hparams()`.
+_DEFAULT_HPARAMS = dict(
+    train_input_pattern="",
+    eval_input_pattern="",
+    learning_rate=0.01,
+    train_batch_size=8,
+    eval_batch_size=8,
+    checkpoint_secs=120,
+    num_checkpoints=100,
+    num_train_steps=10000,
+    num_eval_steps=100,
+    loss="softmax_loss",
+    list_size=10,
+    convert_labels_to_binary=False,
+    model_dir=None)
+
+
 def _get_hparams():
-  hparams = dict(
-      train_input_pattern="",
-      eval_input_pattern="",
-      learning_rate=0.01,
-      train_batch_size=8,
-      eval_batch_size=8,
-      checkpoint_secs=120,
-      num_checkpoints=100,
-      num_train_steps=10000,
-      num_eval_steps=100,
-      loss="softmax_loss",
-      list_size=10,
-      convert_labels_to_binary=False,
-      model_dir=None)
-  return hparams
-
-
-class EstimatorBuilderTest(tf.test.TestCase):
+  return dict(_DEFAULT_HPARAMS)
+
+
+# The optimizer is built lazily on first use and then shared, since the
+# builder stores it by reference and the tests never mutate it.
+@functools.lru_cache(maxsize=1)
+def _adam_optimizer():
+  return tf.compat.v1.train.AdamOptimizer(learning_rate=0.01)
+
+
+# The process-wide default estimator backing the `setUpClass` fixture.
+@functools.lru_cache(maxsize=1)
+def _default_estimator():
+  return tfr_estimator.EstimatorBuilder(
+      _context_feature_columns(),
+      _example_feature_columns(),
+      _scoring_function,
+      hparams=_DEFAULT_HPARAMS)
+
+
+# The default `_transform_fn` wrapped with tf.function once; each mode gets
+# its own concrete trace, which is reused across calls within that mode.
+@functools.lru_cache(maxsize=1)
+def _graph_transform_fn():
+  return tf.function(
+      _default_estimator()._transform_fn, experimental_relax_shapes=True)
+
+
+# Checks the transformed tensors in one graph call; a mismatch raises an
+# InvalidArgumentError from the graph, so no tensor is copied to the host
+# per comparison.
+@tf.function
+def _assert_transform_output(context, example, expected_context,
+                             expected_example):
+  tf.debugging.assert_equal(context["c1"], expected_context)
+  tf.debugging.assert_equal(example["f1"], expected_example)
+
+
+# Numpy references for assertions. Comparing against numpy arrays avoids a
+# device-to-host copy of the expected side on every assertion.
+_NP_ONES_10_1 = np.ones((10, 1), np.float32)
+_NP_ONES_10_1_1 = np.ones((10, 1, 1), np.float32)
+_NP_ONES_10_10_1 = np.ones((10, 10, 1), np.float32)
+_NP_TWOS_10_1 = np.full((10, 1), 2.0, np.float32)
+_NP_TWOS_10_10_1 = np.full((10, 10, 1), 2.0, np.float32)
+
+# Input tensors shared by the tests below, allocated once at import time
+# instead of once per test case.
+_ONES_10_1 = tf.ones([10, 1], dtype=tf.float32)
+_ONES_10_10_1 = tf.ones([10, 10, 1], dtype=tf.float32)
+
+# Listwise inputs: 3-D example features and 2-D context features. `tf.fill`
+# creates the scaled tensors in one op, instead of a `Fill` plus a `Mul`.
+_LISTWISE_FEATURES = {
+    "f1": _ONES_10_10_1,
+    "f2": tf.fill([10, 10, 1], 2.0),
+    "f3": tf.fill([10, 10, 1], 3.0),
+    "c1": _ONES_10_1,
+    "c2": tf.fill([10, 1], 2.0),
+}
+
+# Pointwise inputs: both example and context features are 2-D.
+_POINTWISE_FEATURES = {
+    "f1": _ONES_10_1,
+    "f2": tf.fill([10, 1], 2.0),
+    "f3": tf.fill([10, 1], 3.0),
+    "c1": _ONES_10_1,
+    "c2": tf.fill([10, 1], 2.0),
+}
+
+
+class EstimatorBuilderTest(tf.test.TestCase, parameterized.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    super(EstimatorBuilderTest, cls).setUpClass()
+    # Tests that only read from the builder share this instance. Tests that
+    # need an isolated builder call `_create_default_estimator()` instead.
+    cls._shared_estimator = _default_estimator()
 
   def _create_default_estimator(self):
     return tfr_estimator.EstimatorBuilder(
         _context_feature_columns(),
         _example_feature_columns(),
         _scoring_function,
-        hparams=_get_hparams())
+        hparams=_DEFAULT_HPARAMS)
 
   def test_create_estimator_with_misspecified_args(self):
     hparams = _get_hparams()
@@ -118,8 +231,8 @@ class EstimatorBuilderTest(tf.test.TestCase):
         _context_feature_columns,
         _example_feature_columns,
         _scoring_function,
-        optimizer=tf.compat.v1.train.AdamOptimizer(learning_rate=0.01),
-        hparams=_get_hparams())
+        optimizer=_adam_optimizer(),
+        hparams=_DEFAULT_HPARAMS)
     self.assertIsInstance(pip, tfr_estimator.EstimatorBuilder)
 
     # Adding "learning_rate" to hparams (no optimizer) also silences the errors.
@@ -129,23 +242,22 @@ class EstimatorBuilderTest(tf.test.TestCase):
         _example_feature_columns,
         _scoring_function,
         optimizer=None,
-        hparams=_get_hparams())
+        hparams=_DEFAULT_HPARAMS)
     self.assertIsInstance(pip, tfr_estimator.EstimatorBuilder)
 
-  def test_default_transform_fn(self):
-    estimator_with_default_transform_fn = self._create_default_estimator()
-
-    # The below tests the `transform_fn` in the TRAIN mode. In this mode, the
-    # `_transform_fn` invokes the `encode_listwise_features()`, which requires
-    # 3D example features and 2D context features.
-    context, example = estimator_with_default_transform_fn._transform_fn(
-        {
-            "f1": tf.ones([10, 10, 1], dtype=tf.float32),
-            "f2": tf.ones([10, 10, 1], dtype=tf.float32) * 2.0,
-            "f3": tf.ones([10, 10, 1], dtype=tf.float32) * 3.0,
-            "c1": tf.ones([10, 1], dtype=tf.float32),
-            "c2": tf.ones([10, 1], dtype=tf.float32) * 2.0,
-        }, tf.estimator.ModeKeys.TRAIN)
+  # In the TRAIN mode, the `_transform_fn` invokes the
+  # `encode_listwise_features()`, which requires 3D example features and 2D
+  # context features. In the PREDICT mode, it invokes the
+  # `encode_pointwise_features()`, which requires 2D example features and 2D
+  # context features, and produces 3D example tensors. Both modes share the
+  # estimator built in `setUpClass`.
+  @parameterized.named_parameters(
+      ("train", tf.estimator.ModeKeys.TRAIN, _LISTWISE_FEATURES,
+       _NP_ONES_10_10_1),
+      ("predict", tf.estimator.ModeKeys.PREDICT, _POINTWISE_FEATURES,
+       _NP_ONES_10_1_1))
+  def test_default_transform_fn(self, mode, features, expected_example):
+    context, example = _graph_transform_fn()(features, mode)
     # `c1` is the only context feature defined in `_context_feature_columns()`.
     self.assertCountEqual(context.keys(), ["c1"])
 
@@ -153,24 +265,7 @@ class EstimatorBuilderTest(tf.test.TestCase):
     self.assertCountEqual(example.keys(), ["f1", "f2", "f3"])
 
     # Validates the `context` and `example` features are transformed correctly.
-    self.assertAllEqual(tf.ones(shape=[10, 1]), context["c1"])
-    self.assertAllEqual(tf.ones(shape=[10, 10, 1]), example["f1"])
-
-    # The below tests the `transform_fn` in the PREDICT mode. In this mode, the
-    # `_transform_fn` invokes the `encode_pointwise_features()`, which requires
-    # 2D example features and 2D context features.
-    context, example = estimator_with_default_transform_fn._transform_fn(
-        {
-            "f1": tf.ones([10, 1], dtype=tf.float32),
-            "f2": tf.ones([10, 1], dtype=tf.float32) * 2.0,
-            "f3": tf.ones([10, 1], dtype=tf.float32) * 3.0,
-            "c1": tf.ones([10, 1], dtype=tf.float32),
-            "c2": tf.ones([10, 1], dtype=tf.float32) * 2.0,
-        }, tf.estimator.ModeKeys.PREDICT)
-
-    # After transformation, we get 2D context tensor and 3D example tensor.
-    self.assertAllEqual(tf.ones(shape=[10, 1]), context["c1"])
-    self.assertAllEqual(tf.ones(shape=[10, 1, 1]), example["f1"])
+    _assert_transform_output(context, example, _NP_ONES_10_1, expected_example)
 
   def test_custom_transform_fn(self):
     estimator_with_customized_transform_fn = tfr_estimator.EstimatorBuilder(
@@ -178,42 +273,70 @@ class EstimatorBuilderTest(tf.test.TestCase):
         _example_feature_columns(),
         _scoring_function,
         transform_function=_multiply_by_two_transform_fn,
-        hparams=_get_hparams())
+        hparams=_DEFAULT_HPARAMS)
 
     context, example = estimator_with_customized_transform_fn._transform_fn(
-        {
-            "f1": tf.ones([10, 10, 1], dtype=tf.float32),
-            "f2": tf.ones([10, 10, 1], dtype=tf.float32) * 2.0,
-            "f3": tf.ones([10, 10, 1], dtype=tf.float32) * 3.0,
-            "c1": tf.ones([10, 1], dtype=tf.float32),
-            "c2": tf.ones([10, 1], dtype=tf.float32) * 2.0,
-        }, tf.estimator.ModeKeys.TRAIN)
+        _LISTWISE_FEATURES, tf.estimator.ModeKeys.TRAIN)
 
     self.assertCountEqual(context.keys(), ["c1"])
     self.assertCountEqual(example.keys(), ["f1", "f2", "f3"])
     # By adopting `_multiply_by_two_transform_fn`, the `context` and `example`
     # tensors will be both multiplied by 2.
-    self.assertAllEqual(2 * tf.ones(shape=[10, 1]), context["c1"])
-    self.assertAllEqual(2 * tf.ones(shape=[10, 10, 1]), example["f1"])
+    _assert_transform_output(context, example, _NP_TWOS_10_1, _NP_TWOS_10_10_1)
+
+  @parameterized.named_parameters(
+      ("train", tf.estimator.ModeKeys.TRAIN, _LISTWISE_FEATURES),
+      ("predict", tf.estimator.ModeKeys.PREDICT, _POINTWISE_FEATURES))
+  def test_get_concrete_transform_fn(self, mode, mode_features):
+    estimator = self._shared_estimator
+    transform_fn = estimator.get_concrete_transform_fn(mode)
+
+    # The transform fn is traced once per mode and then reused.
+    self.assertIs(transform_fn, estimator.get_concrete_transform_fn(mode))
+
+    # The concrete function only accepts the declared feature columns.
+    features = {
+        name: mode_features[name] for name in ["c1", "f1", "f2", "f3"]
+    }
+    context, example = transform_fn(features)
+    self.assertCountEqual(context.keys(), ["c1"])
+    self.assertCountEqual(example.keys(), ["f1", "f2", "f3"])
+
+  def test_get_concrete_transform_fn_with_non_dense_column(self):
+    # Categorical columns parse to `SparseTensor`s, which cannot be described
+    # by the dense `TensorSpec` signature.
+    estimator = tfr_estimator.EstimatorBuilder(
+        _context_feature_columns(),
+        {
+            "f1":
+                tf.feature_column.categorical_column_with_identity(
+                    "f1", num_buckets=10)
+        },
+        _scoring_function,
+        hparams=_DEFAULT_HPARAMS)
+    with self.assertRaises(ValueError):
+      estimator.get_concrete_transform_fn(tf.estimator.ModeKeys.TRAIN)
 
   def test_group_score_fn(self):
-    estimator = self._create_default_estimator()
-    logits = estimator._group_score_fn(
-        {"c1": tf.ones([10, 1], dtype=tf.float32)},
-        {"f1": tf.ones([10, 1, 1], dtype=tf.float32)},
-        tf.estimator.ModeKeys.TRAIN, None, None)
+    estimator = self._shared_estimator
+    logits = estimator._group_score_fn({"c1": _NP_ONES_10_1},
+                                       {"f1": _NP_ONES_10_1_1},
+                                       tf.estimator.ModeKeys.TRAIN, None, None)
 
-    self.assertAllEqual(logits, tf.ones([10, 1], dtype=tf.float32))
+    self.assertAllEqual(logits, _NP_ONES_10_1)
 
   def test_eval_metric_fns(self):
-    estimator = self._create_default_estimator()
+    estimator = self._shared_estimator
     self.assertCountEqual(estimator._eval_metric_fns().keys(), [
         "metric/mrr", "metric/mrr_10", "metric/ndcg", "metric/ndcg_10",
         "metric/ndcg_5"
     ])
 
+    # The metric fns are built once and then cached on the builder.
+    self.assertIs(estimator._eval_metric_fns(), estimator._eval_metric_fns())
+
   def test_optimizer(self):
-    estimator_with_default_optimizer = self._create_default_estimator()
+    estimator_with_default_optimizer = self._shared_estimator
     self.assertIsInstance(estimator_with_default_optimizer._optimizer,
                           tf.compat.v1.train.AdagradOptimizer)
 
@@ -221,8 +344,8 @@ class EstimatorBuilderTest(tf.test.TestCase):
         _context_feature_columns(),
         _example_feature_columns(),
         _scoring_function,
-        optimizer=tf.compat.v1.train.AdamOptimizer(learning_rate=0.01),
-        hparams=_get_hparams())
+        optimizer=_adam_optimizer(),
+        hparams=_DEFAULT_HPARAMS)
     self.assertIsInstance(estimator_with_adam_optimizer._optimizer,
                           tf.compat.v1.train.AdamOptimizer)
 